@@ -1,22 +1,19 @@
+import functools
+import hashlib
 import io
 import os
-import math
 import datetime as dt
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
-# PDF
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import mm
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib import colors
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+# Copy-on-write: savunmacı .copy() olmadan view'ların güvenle paylaşılmasını sağlar
+# (pandas 3.0'da zaten varsayılan olacak)
+pd.set_option("mode.copy_on_write", True)
 
-# PNG
-import matplotlib.pyplot as plt
+# NOT: reportlab ve PIL importları cold start'ı şişirmemek için
+# PDF/PNG üreten fonksiyonların içinde (lazy) yapılır.
 
 
 # =========================================
@@ -28,6 +25,10 @@ PREPARERS = {
     "Mert Özen": {"email": "mert.ozen@kodsan.com.tr", "telefon": "0 542 235 33 77"},
 }
 
+# Selectbox seçenekleri; script gövdesi her rerun'da baştan çalıştığı için bu
+# bir performans kazancı değil, PREPARERS'ın yanında duran bir üslup tercihi
+_PREPARER_NAMES = list(PREPARERS.keys())
+
 NOTES = [
     "<b>FİYAT :</b> Fiyatlar EUR bazında olup KDV hariçtir.",
     "<b>DÖVİZ KURU :</b> Fatura tarihindeki TCMB Euro DSK (Döviz Satış Kuru) esas alınarak fatura TÜRK LİRASI üzerinden kesilecek ve ödeme TÜRK LİRASI üzerinden yapılacaktır; gün içerisinde serbest piyasa kuru T.C.M.B’nin belirlemiş olduğu efektif satış kurunu %1 oranında aşmış ise T.C.M.B kuru yerine serbest piyasa kuru geçerli olacaktır.",
@@ -47,11 +48,14 @@ def today_tr() -> dt.date:
     return dt.date.today()
 
 
+# "1,234.56" -> "1.234,56": tek geçişte , ve . takası
+_TR_TRANS = str.maketrans({",": ".", ".": ","})
+
+
 def eur_fmt_dec(x: float, decimals: int = 2) -> str:
-    if x is None or (isinstance(x, float) and math.isnan(x)):
+    if x is None or x != x:  # NaN kendine eşit değildir
         return ""
-    s = f"{x:,.{decimals}f}"
-    return s.replace(",", "_").replace(".", ",").replace("_", ".")
+    return f"{x:,.{decimals}f}".translate(_TR_TRANS)
 
 
 def normalize_price_list(df: pd.DataFrame) -> pd.DataFrame:
@@ -78,37 +82,149 @@ def normalize_price_list(df: pd.DataFrame) -> pd.DataFrame:
     df["MODEL"] = df["MODEL"].astype(str).str.strip()
     df["AÇIKLAMA"] = df["AÇIKLAMA"].astype(str).str.strip()
 
-    def to_num(v):
-        if pd.isna(v):
-            return None
-        if isinstance(v, (int, float)):
-            return float(v)
-        s = str(v).strip().replace(" ", "")
-        if "," in s and "." in s:
-            s = s.replace(".", "").replace(",", ".")
-        else:
-            s = s.replace(",", ".")
+    # Fiyat kolonu: vektörel temizlik (satır satır .apply yerine tek geçiş)
+    if pd.api.types.is_numeric_dtype(df["LİSTE FİYATI"]):
+        df["LİSTE FİYATI"] = df["LİSTE FİYATI"].astype(float)
+    else:
+        s = df["LİSTE FİYATI"].astype(str).str.strip().str.replace(" ", "", regex=False)
+        # "1.234,56" (TR) -> "1234.56"; sadece virgüllüler -> "." ondalık
+        tr_mask = s.str.contains(",", regex=False) & s.str.contains(".", regex=False)
+        s.loc[tr_mask] = s.loc[tr_mask].str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+        s.loc[~tr_mask] = s.loc[~tr_mask].str.replace(",", ".", regex=False)
+        df["LİSTE FİYATI"] = pd.to_numeric(s, errors="coerce")
+    df = df.dropna(subset=["LİSTE FİYATI"])
+    df["LİSTE FİYATI"] = df["LİSTE FİYATI"].astype(float)
+
+    # Arama için büyük harfli birleşik kolon bir kez burada hesaplanır; tek contains
+    # taraması yeter ("\x1f" ayraç: model sonu ile açıklama başı yapışıp eşleşmesin)
+    df["_SEARCH_U"] = df["MODEL"].str.upper() + "\x1f" + df["AÇIKLAMA"].str.upper()
+    try:
+        # Arrow string dtype: contains taraması PyObject deref'siz, Arrow'un
+        # C++ substring kernel'inde koşar; pyarrow yoksa object dtype kalır
+        df["_SEARCH_U"] = df["_SEARCH_U"].astype("string[pyarrow]")
+    except ImportError:
+        pass
+
+    # Liste fiyatının TR formatlı hali; selectbox etiketleri her rerun'da
+    # yeniden formatlamak yerine buradan okur
+    df["_PRICE_FMT"] = df["LİSTE FİYATI"].map("{:,.2f}".format).str.translate(_TR_TRANS)
+
+    # MODEL tekrar eden kısa kodlardan oluşur; category dtype eşitlik/maske
+    # işlemlerini kategori kodları üzerinden yapar ve belleği küçültür
+    df["MODEL"] = df["MODEL"].astype("category")
+    return df
+
+
+# Bu boyutun üstündeki xlsx'ler read_only streaming ile okunur (tam XML DOM kurulmaz)
+_XLSX_STREAM_THRESHOLD = 4 * 1024 * 1024
+
+
+def _read_xlsx_streaming(file_bytes: bytes) -> pd.DataFrame:
+    from openpyxl import load_workbook
+
+    wb = load_workbook(io.BytesIO(file_bytes), read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        return pd.DataFrame(list(rows), columns=list(header or []))
+    finally:
+        wb.close()
+
+
+# Normalize edilmiş listelerin diske yazıldığı parquet cache'i: aynı dosya
+# yeni bir oturumda/yeniden başlatmada Excel parse'ı olmadan geri gelir
+_PL_CACHE_DIR = ".pl_cache"
+
+
+@st.cache_data(show_spinner=False)
+def load_price_list(file_bytes: bytes, name: str) -> pd.DataFrame:
+    """Yüklenen dosyayı bir kez parse eder; aynı dosya için rerun'larda cache'ten döner."""
+    digest = hashlib.blake2b(file_bytes, digest_size=16).hexdigest()
+    cache_path = os.path.join(_PL_CACHE_DIR, f"{digest}.parquet")
+    if os.path.exists(cache_path):
         try:
-            return float(s)
+            df = pd.read_parquet(cache_path)
+            # parquet roundtrip'i arrow string dtype'ını korumaz; geri yükle
+            df["_SEARCH_U"] = df["_SEARCH_U"].astype("string[pyarrow]")
+            return df
         except Exception:
-            return None
+            pass  # bozuk/uyumsuz cache dosyası: baştan parse et
 
-    df["LİSTE FİYATI"] = df["LİSTE FİYATI"].apply(to_num)
-    df = df.dropna(subset=["LİSTE FİYATI"])
-    df["LİSTE FİYATI"] = df["LİSTE FİYATI"].astype(float)
+    lower = name.lower()
+    if lower.endswith(".csv"):
+        try:
+            # Arrow'un CSV okuyucusu; pyarrow yoksa varsayılan C parser
+            df = pd.read_csv(io.BytesIO(file_bytes), engine="pyarrow")
+        except ImportError:
+            df = pd.read_csv(io.BytesIO(file_bytes))
+    elif lower.endswith(".xls"):
+        df = pd.read_excel(io.BytesIO(file_bytes), engine="xlrd", sheet_name=0)
+    else:
+        try:
+            # Rust tabanlı calamine, openpyxl'den kat kat hızlı parse eder
+            df = pd.read_excel(io.BytesIO(file_bytes), engine="calamine", sheet_name=0)
+        except ImportError:
+            if len(file_bytes) > _XLSX_STREAM_THRESHOLD:
+                df = _read_xlsx_streaming(file_bytes)
+            else:
+                df = pd.read_excel(io.BytesIO(file_bytes), engine="openpyxl", sheet_name=0)
+
+    df = normalize_price_list(df)
+    try:
+        os.makedirs(_PL_CACHE_DIR, exist_ok=True)
+        df.to_parquet(cache_path, compression="zstd")
+    except Exception:
+        pass  # pyarrow yok veya disk yazılamıyor: cache'siz devam
     return df
 
 
+@st.cache_data(show_spinner=False)
+def load_disk_price_list(path: str, mtime: float) -> pd.DataFrame:
+    # mtime cache anahtarının parçası: dosya değişirse yeniden okunur
+    return normalize_price_list(pd.read_csv(path))
+
+
+@st.cache_data(show_spinner=False)
+def demo_price_list() -> pd.DataFrame:
+    # Süreç başına bir kez kurulur (Streamlit script gövdesini her rerun'da
+    # yeniden çalıştırdığı için modül seviyesi sabit yeterli olmazdı)
+    return normalize_price_list(
+        pd.DataFrame(
+            [
+                {
+                    "MODEL": "KSH-0800-V5.1",
+                    "AÇIKLAMA": "SOLAR & ISI POMPASI BOYLER - ÇİFT SERPANTİNLİ 800 LİTRE - 10 BAR",
+                    "LİSTE FİYATI": 2215,
+                }
+            ]
+        )
+    )
+
+
 def calc_discounted(list_price: float, discount_pct: float) -> float:
     return list_price * (1.0 - (discount_pct / 100.0))
 
 
+# Aynı script çalışmasında ikinci PDF build'inde dosya/font kontrollerini atla
+_FONTS_REGISTERED = False
+
+
 def ensure_fonts_registered():
     """
     Repo'da bulunmalı:
       fonts/DejaVuSans.ttf
       fonts/DejaVuSans-Bold.ttf
+
+    İlk başarılı kayıttan sonra no-op; rerun'lar arasında da getFont
+    kontrolü sayesinde TTF dosyaları yeniden parse edilmez.
     """
+    global _FONTS_REGISTERED
+    if _FONTS_REGISTERED:
+        return
+
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
     reg_path = os.path.join("fonts", "DejaVuSans.ttf")
     bold_path = os.path.join("fonts", "DejaVuSans-Bold.ttf")
 
@@ -127,16 +243,38 @@ def ensure_fonts_registered():
     except Exception:
         pdfmetrics.registerFont(TTFont("DejaVuSans-Bold", bold_path))
 
+    _FONTS_REGISTERED = True
+
 
 # =========================================
 # PDF Watermark (diagonal, full-page feel)
 # =========================================
+@functools.lru_cache(maxsize=8)
+def _watermark_font_size(text: str) -> int:
+    """Metni sayfa köşegenine sığdıran font boyutu; metin başına bir kez hesaplanır."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+
+    w, h = A4
+    target = (w * w + h * h) ** 0.5 * 0.72
+
+    font_size = 190
+    while font_size > 80:
+        if pdfmetrics.stringWidth(text, "DejaVuSans-Bold", font_size) <= target:
+            break
+        font_size -= 2
+    return font_size
+
+
 def _watermark(canvas, doc, text: str = "KODSAN"):
     """
     - Açı artırıldı (45°)
     - Yazı sayfaya sığacak şekilde font otomatik ayarlanır
     - Alpha çalışmazsa çok açık gri fallback
     """
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+
     w, h = A4
     canvas.saveState()
 
@@ -154,16 +292,7 @@ def _watermark(canvas, doc, text: str = "KODSAN"):
     else:
         canvas.setFillColor(colors.HexColor("#EFEFEF"))
 
-    diag = (w * w + h * h) ** 0.5
-    target = diag * 0.72
-
-    font_size = 190
-    while font_size > 80:
-        tw = canvas.stringWidth(text, font_name, font_size)
-        if tw <= target:
-            break
-        font_size -= 2
-
+    font_size = _watermark_font_size(text)
     canvas.setFont(font_name, font_size)
 
     canvas.translate(w / 2.0, h / 2.0)
@@ -175,8 +304,100 @@ def _watermark(canvas, doc, text: str = "KODSAN"):
     canvas.restoreState()
 
 
+@functools.lru_cache(maxsize=1)
+def _pdf_styles() -> dict:
+    """Paragraph/Table stilleri immutable; bir kez kurulur, Document'lar arası paylaşılır."""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.platypus import TableStyle
+
+    styles = getSampleStyleSheet()
+
+    return {
+        "title": ParagraphStyle(
+            "title_style",
+            parent=styles["Heading2"],
+            fontName="DejaVuSans-Bold",
+            fontSize=14,
+            leading=16,
+            spaceAfter=4,
+        ),
+        "normal": ParagraphStyle(
+            "normal",
+            parent=styles["Normal"],
+            fontName="DejaVuSans",
+            fontSize=9,
+            leading=11,
+        ),
+        # Table cell styles (küçük font + satır kırma)
+        "cell_model": ParagraphStyle(
+            "cell_model",
+            parent=styles["Normal"],
+            fontName="DejaVuSans",
+            fontSize=7.4,
+            leading=9,
+        ),
+        "cell_desc": ParagraphStyle(
+            "cell_desc",
+            parent=styles["Normal"],
+            fontName="DejaVuSans",
+            fontSize=7.2,
+            leading=9,
+        ),
+        "cell_num": ParagraphStyle(
+            "cell_num",
+            parent=styles["Normal"],
+            fontName="DejaVuSans",
+            fontSize=7.4,
+            leading=9,
+            alignment=2,  # RIGHT
+        ),
+        "small": ParagraphStyle(
+            "small",
+            parent=styles["BodyText"],
+            fontName="DejaVuSans",
+            fontSize=8.2,
+            leading=10,
+        ),
+        "info_table": TableStyle(
+            [
+                ("FONTNAME", (0, 0), (-1, -1), "DejaVuSans"),
+                ("FONTSIZE", (0, 0), (-1, -1), 9),
+                ("GRID", (0, 0), (-1, -1), 0.25, colors.lightgrey),
+                ("BACKGROUND", (0, 0), (0, -1), colors.whitesmoke),
+                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+                ("LEFTPADDING", (0, 0), (-1, -1), 4),
+                ("RIGHTPADDING", (0, 0), (-1, -1), 4),
+                ("TOPPADDING", (0, 0), (-1, -1), 2),
+                ("BOTTOMPADDING", (0, 0), (-1, -1), 2),
+            ]
+        ),
+        "prod_table": TableStyle(
+            [
+                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#F2F2F2")),
+                ("FONTNAME", (0, 0), (-1, 0), "DejaVuSans-Bold"),
+                ("FONTSIZE", (0, 0), (-1, 0), 8.2),
+                ("GRID", (0, 0), (-1, -1), 0.25, colors.lightgrey),
+                ("VALIGN", (0, 0), (-1, -1), "TOP"),
+                ("ALIGN", (2, 1), (4, -1), "RIGHT"),
+                ("LEFTPADDING", (0, 0), (-1, -1), 3),
+                ("RIGHTPADDING", (0, 0), (-1, -1), 3),
+                ("TOPPADDING", (0, 0), (-1, -1), 2),
+                ("BOTTOMPADDING", (0, 0), (-1, -1), 2),
+            ]
+        ),
+    }
+
+
 def build_pdf_bytes(meta: dict, cart_df: pd.DataFrame, total: float) -> bytes:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table
+
     ensure_fonts_registered()
+    s = _pdf_styles()
+    normal = s["normal"]
+    cell_model, cell_desc, cell_num = s["cell_model"], s["cell_desc"], s["cell_num"]
 
     buf = io.BytesIO()
     doc = SimpleDocTemplate(
@@ -189,61 +410,8 @@ def build_pdf_bytes(meta: dict, cart_df: pd.DataFrame, total: float) -> bytes:
         title="KODSAN TEKLİF",
     )
 
-    styles = getSampleStyleSheet()
-
-    title_style = ParagraphStyle(
-        "title_style",
-        parent=styles["Heading2"],
-        fontName="DejaVuSans-Bold",
-        fontSize=14,
-        leading=16,
-        spaceAfter=4,
-    )
-
-    normal = ParagraphStyle(
-        "normal",
-        parent=styles["Normal"],
-        fontName="DejaVuSans",
-        fontSize=9,
-        leading=11,
-    )
-
-    # Table cell styles (küçük font + satır kırma)
-    cell_model = ParagraphStyle(
-        "cell_model",
-        parent=styles["Normal"],
-        fontName="DejaVuSans",
-        fontSize=7.4,
-        leading=9,
-    )
-
-    cell_desc = ParagraphStyle(
-        "cell_desc",
-        parent=styles["Normal"],
-        fontName="DejaVuSans",
-        fontSize=7.2,
-        leading=9,
-    )
-
-    cell_num = ParagraphStyle(
-        "cell_num",
-        parent=styles["Normal"],
-        fontName="DejaVuSans",
-        fontSize=7.4,
-        leading=9,
-        alignment=2,  # RIGHT
-    )
-
-    small = ParagraphStyle(
-        "small",
-        parent=styles["BodyText"],
-        fontName="DejaVuSans",
-        fontSize=8.2,
-        leading=10,
-    )
-
     story = []
-    story.append(Paragraph("KODSAN TEKLİF", title_style))
+    story.append(Paragraph("KODSAN TEKLİF", s["title"]))
     story.append(Spacer(1, 3 * mm))
 
     # Üst bilgiler (iskonto PDF'de yok)
@@ -258,60 +426,33 @@ def build_pdf_bytes(meta: dict, cart_df: pd.DataFrame, total: float) -> bytes:
         ["Telefon", meta["telefon"]],
     ]
     info_tbl = Table(info_data, colWidths=[34 * mm, 150 * mm])
-    info_tbl.setStyle(
-        TableStyle(
-            [
-                ("FONTNAME", (0, 0), (-1, -1), "DejaVuSans"),
-                ("FONTSIZE", (0, 0), (-1, -1), 9),
-                ("GRID", (0, 0), (-1, -1), 0.25, colors.lightgrey),
-                ("BACKGROUND", (0, 0), (0, -1), colors.whitesmoke),
-                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                ("LEFTPADDING", (0, 0), (-1, -1), 4),
-                ("RIGHTPADDING", (0, 0), (-1, -1), 4),
-                ("TOPPADDING", (0, 0), (-1, -1), 2),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 2),
-            ]
-        )
-    )
+    info_tbl.setStyle(s["info_table"])
     story.append(info_tbl)
     story.append(Spacer(1, 5 * mm))
 
     # Ürün tablosu
     header = ["Model", "Açıklama", "Adet", "Birim (EUR)", "Tutar (EUR)"]
     rows = [header]
-
-    for _, r in cart_df.iterrows():
-        rows.append(
-            [
-                Paragraph(str(r["MODEL"]), cell_model),
-                Paragraph(str(r["AÇIKLAMA"]), cell_desc),  # satır kırar
-                Paragraph(str(int(r["ADET"])), cell_num),
-                Paragraph(eur_fmt_dec(float(r["BİRİM (EUR)"]), 2), cell_num),
-                Paragraph(eur_fmt_dec(float(r["TOPLAM (EUR)"]), 2), cell_num),
-            ]
-        )
+    # Kolonlar sepete eklenirken tiplenmiş durumda; satır başına cast gerekmez
+    rows += [
+        [
+            Paragraph(str(model), cell_model),
+            Paragraph(str(aciklama), cell_desc),  # satır kırar
+            Paragraph(str(adet), cell_num),
+            Paragraph(eur_fmt_dec(birim, 2), cell_num),
+            Paragraph(eur_fmt_dec(toplam, 2), cell_num),
+        ]
+        for model, aciklama, adet, birim, toplam in cart_df[
+            ["MODEL", "AÇIKLAMA", "ADET", "BİRİM (EUR)", "TOPLAM (EUR)"]
+        ].itertuples(index=False, name=None)
+    ]
 
     prod_tbl = Table(
         rows,
         colWidths=[36 * mm, 88 * mm, 10 * mm, 25 * mm, 25 * mm],
         repeatRows=1,
     )
-    prod_tbl.setStyle(
-        TableStyle(
-            [
-                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#F2F2F2")),
-                ("FONTNAME", (0, 0), (-1, 0), "DejaVuSans-Bold"),
-                ("FONTSIZE", (0, 0), (-1, 0), 8.2),
-                ("GRID", (0, 0), (-1, -1), 0.25, colors.lightgrey),
-                ("VALIGN", (0, 0), (-1, -1), "TOP"),
-                ("ALIGN", (2, 1), (4, -1), "RIGHT"),
-                ("LEFTPADDING", (0, 0), (-1, -1), 3),
-                ("RIGHTPADDING", (0, 0), (-1, -1), 3),
-                ("TOPPADDING", (0, 0), (-1, -1), 2),
-                ("BOTTOMPADDING", (0, 0), (-1, -1), 2),
-            ]
-        )
-    )
+    prod_tbl.setStyle(s["prod_table"])
 
     story.append(prod_tbl)
     story.append(Spacer(1, 4 * mm))
@@ -322,7 +463,7 @@ def build_pdf_bytes(meta: dict, cart_df: pd.DataFrame, total: float) -> bytes:
     story.append(Paragraph("<b>NOTLAR</b>", normal))
     story.append(Spacer(1, 1.5 * mm))
     for n in NOTES:
-        story.append(Paragraph(n, small))
+        story.append(Paragraph(n, s["small"]))
         story.append(Spacer(1, 1.2 * mm))
 
     doc.build(
@@ -339,37 +480,102 @@ def build_pdf_bytes(meta: dict, cart_df: pd.DataFrame, total: float) -> bytes:
 # =========================================
 # PNG output
 # =========================================
+_PNG_HEADER = ["MODEL", "AÇIKLAMA", "ADET", "BİRİM (EUR)", "TOPLAM (EUR)"]
+
+
 def build_table_png_bytes(cart_df: pd.DataFrame, meta: dict, total: float) -> bytes:
-    view = cart_df.copy()
-    view["BİRİM (EUR)"] = view["BİRİM (EUR)"].map(lambda v: eur_fmt_dec(float(v), 2))
-    view["TOPLAM (EUR)"] = view["TOPLAM (EUR)"].map(lambda v: eur_fmt_dec(float(v), 2))
-    view["ADET"] = view["ADET"].astype(int).astype(str)
+    """Tabloyu PIL ile rasterize eder (matplotlib figure/axes yükü olmadan)."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    font = ImageFont.truetype(os.path.join("fonts", "DejaVuSans.ttf"), 16)
+    font_bold = ImageFont.truetype(os.path.join("fonts", "DejaVuSans-Bold.ttf"), 16)
 
     title = f"{meta['firma']} | {meta['proje']} | Toplam: {eur_fmt_dec(total, 2)} EUR + KDV"
 
-    fig_h = 1.2 + 0.35 * max(1, len(view))
-    fig, ax = plt.subplots(figsize=(12, fig_h))
-    ax.axis("off")
-    ax.set_title(title, fontsize=11, pad=10)
-
-    tbl = ax.table(
-        cellText=view[["MODEL", "AÇIKLAMA", "ADET", "BİRİM (EUR)", "TOPLAM (EUR)"]].values,
-        colLabels=["MODEL", "AÇIKLAMA", "ADET", "BİRİM (EUR)", "TOPLAM (EUR)"],
-        cellLoc="left",
-        colLoc="left",
-        loc="center",
-    )
-    tbl.auto_set_font_size(False)
-    tbl.set_fontsize(8.5)
-    tbl.scale(1, 1.2)
+    rows = [
+        (str(model), str(aciklama), str(adet), eur_fmt_dec(birim, 2), eur_fmt_dec(toplam, 2))
+        for model, aciklama, adet, birim, toplam in cart_df[_PNG_HEADER].itertuples(index=False, name=None)
+    ]
+
+    pad_x, pad_y = 10, 6
+    measure = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    col_w = []
+    for j, name in enumerate(_PNG_HEADER):
+        widest = measure.textlength(name, font=font_bold)
+        for r in rows:
+            widest = max(widest, measure.textlength(r[j], font=font))
+        col_w.append(int(widest) + 2 * pad_x)
+
+    row_h = 16 + 2 * pad_y
+    title_h = row_h + pad_y
+    # Başlık satırı tablodan geniş olabilir; canvas ikisinden genişine göre açılır
+    title_w = int(measure.textlength(title, font=font_bold))
+    W = max(sum(col_w), title_w + 2 * pad_x) + 1
+    H = title_h + (len(rows) + 1) * row_h + 1
+
+    img = Image.new("RGB", (W, H), "white")
+    draw = ImageDraw.Draw(img)
+
+    draw.text((pad_x, pad_y), title, font=font_bold, fill="black")
+
+    grid = (191, 191, 191)
+    y = title_h
+    # başlık satırı
+    x = 0
+    for j, name in enumerate(_PNG_HEADER):
+        draw.rectangle([x, y, x + col_w[j], y + row_h], fill=(242, 242, 242), outline=grid)
+        draw.text((x + pad_x, y + pad_y), name, font=font_bold, fill="black")
+        x += col_w[j]
+    y += row_h
+
+    for r in rows:
+        x = 0
+        for j, cell in enumerate(r):
+            draw.rectangle([x, y, x + col_w[j], y + row_h], outline=grid)
+            draw.text((x + pad_x, y + pad_y), cell, font=font, fill="black")
+            x += col_w[j]
+        y += row_h
 
     buf = io.BytesIO()
-    plt.tight_layout()
-    fig.savefig(buf, format="png", dpi=200, bbox_inches="tight")
-    plt.close(fig)
+    img.save(buf, "PNG", optimize=True)
     return buf.getvalue()
 
 
+# =========================================
+# Output cache (PDF/PNG her rerun'da yeniden üretilmesin)
+# =========================================
+_CART_KEY_COLS = ["MODEL", "AÇIKLAMA", "ADET", "BİRİM (EUR)", "TOPLAM (EUR)"]
+
+
+def cart_rows_key(cart_df: pd.DataFrame) -> tuple:
+    """Sepeti cache anahtarı olabilecek hashlenebilir tuple'lara çevirir."""
+    return tuple(cart_df[_CART_KEY_COLS].itertuples(index=False, name=None))
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_pdf_cached(meta_items: tuple, rows: tuple, total: float) -> bytes:
+    cart_df = pd.DataFrame(list(rows), columns=_CART_KEY_COLS)
+    return build_pdf_bytes(dict(meta_items), cart_df, total)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def build_png_cached(meta_items: tuple, rows: tuple, total: float) -> bytes:
+    cart_df = pd.DataFrame(list(rows), columns=_CART_KEY_COLS)
+    return build_table_png_bytes(cart_df, dict(meta_items), total)
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def format_cart_lines(rows: tuple) -> str:
+    """Kopyala-yapıştır satır metni; sepet (ve dolayısıyla iskonto) değişmedikçe cache'ten gelir."""
+    df = pd.DataFrame(list(rows), columns=_CART_KEY_COLS)
+    unit_fmt = df["BİRİM (EUR)"].map("{:,.2f}".format).str.translate(_TR_TRANS)
+    lines = df["MODEL"].str.cat(
+        [df["AÇIKLAMA"], df["ADET"].astype(str) + " ADET", unit_fmt + " EUR + KDV"],
+        sep=" / ",
+    )
+    return "\n".join(lines.tolist())
+
+
 # =========================================
 # Streamlit UI
 # =========================================
@@ -379,8 +585,21 @@ st.set_page_config(
     layout="wide"
 )
 
+# Sepet kolon şeması: dict listesi yerine tipli DataFrame (SoA) tutulur,
+# böylece her rerun'da dtype çıkarımı + yeniden kurulum yapılmaz.
+_CART_COLUMNS = {"MODEL": str, "AÇIKLAMA": str, "LİSTE FİYATI": np.float64, "ADET": np.int64}
+
+
+def _empty_cart() -> pd.DataFrame:
+    return pd.DataFrame({c: pd.Series(dtype=t) for c, t in _CART_COLUMNS.items()})
+
+
 if "cart" not in st.session_state:
-    st.session_state.cart = []
+    st.session_state.cart = _empty_cart()
+
+# MODEL -> sepette satır pozisyonu (O(1) mükerrer kontrolü)
+if "cart_index" not in st.session_state:
+    st.session_state.cart_index = {}
 
 if "price_list" not in st.session_state:
     st.session_state.price_list = None
@@ -396,7 +615,7 @@ with st.sidebar:
     proje = st.text_input("PROJE İSMİ", value="")
     iskonto = st.number_input("İSKONTO ORANI (%)", min_value=0.0, max_value=100.0, value=35.0, step=0.5)
 
-    hazirlayan = st.selectbox("TEKLİFİ HAZIRLAYAN", list(PREPARERS.keys()), index=0)
+    hazirlayan = st.selectbox("TEKLİFİ HAZIRLAYAN", _PREPARER_NAMES, index=0)
     email = PREPARERS[hazirlayan]["email"]
     telefon = PREPARERS[hazirlayan]["telefon"]
 
@@ -411,73 +630,71 @@ with st.sidebar:
     st.subheader("Fiyat Listesi")
 
     up = st.file_uploader("Excel/CSV yükle (MODEL, AÇIKLAMA, LİSTE FİYATI)", type=["xlsx", "xls", "csv"])
-    if up is not None:
+    if up is not None and (
+        st.session_state.get("_pl_file_sig") != (up.name, up.size) or st.session_state.price_list is None
+    ):
+        # Aynı dosya zaten yüklüyse bytes'ına dahi dokunma
         try:
-            if up.name.lower().endswith(".csv"):
-                df_pl = pd.read_csv(up)
-            else:
-                df_pl = pd.read_excel(up)
-            df_pl = normalize_price_list(df_pl)
+            df_pl = load_price_list(up.getvalue(), up.name)
             st.session_state.price_list = df_pl
+            st.session_state["_pl_file_sig"] = (up.name, up.size)
             st.success(f"Yüklendi: {len(df_pl)} ürün")
         except Exception as e:
             st.session_state.price_list = None
+            st.session_state["_pl_file_sig"] = None
             st.error(f"Fiyat listesi okunamadı: {e}")
 
     if st.session_state.price_list is None and os.path.exists("price_list.csv"):
         try:
-            df_pl = pd.read_csv("price_list.csv")
-            df_pl = normalize_price_list(df_pl)
+            df_pl = load_disk_price_list("price_list.csv", os.path.getmtime("price_list.csv"))
             st.session_state.price_list = df_pl
             st.info("price_list.csv kullanılıyor.")
         except Exception as e:
             st.warning(f"price_list.csv okunamadı: {e}")
 
     if st.session_state.price_list is None:
-        demo = pd.DataFrame(
-            [
-                {
-                    "MODEL": "KSH-0800-V5.1",
-                    "AÇIKLAMA": "SOLAR & ISI POMPASI BOYLER - ÇİFT SERPANTİNLİ 800 LİTRE - 10 BAR",
-                    "LİSTE FİYATI": 2215,
-                }
-            ]
-        )
-        st.session_state.price_list = demo
+        st.session_state.price_list = demo_price_list()
         st.warning("Demo fiyat listesi aktif. Kendi listenizi yükleyin veya repo'ya price_list.csv ekleyin.")
 
     st.divider()
     if st.button("Sepeti sıfırla", use_container_width=True):
-        st.session_state.cart = []
+        st.session_state.cart = _empty_cart()
+        st.session_state.cart_index = {}
         st.rerun()
 
-pl = st.session_state.price_list.copy()
+pl = st.session_state.price_list
 
 colA, colB = st.columns([1.1, 1.2], gap="large")
 
 with colA:
     st.subheader("Ürün Ekle")
 
-    q = st.text_input("Ürün arama (ör: KSH)", value="")
+    # Form: her tuşta değil, Enter/Ara'da rerun tetiklenir (debounce)
+    with st.form("search_form", clear_on_submit=False, border=False):
+        q = st.text_input("Ürün arama (ör: KSH)", value="")
+        st.form_submit_button("Ara")
+
     filtered = pl
     if q.strip():
         qs = q.strip().upper()
-        filtered = pl[
-            pl["MODEL"].str.upper().str.contains(qs, na=False)
-            | pl["AÇIKLAMA"].str.upper().str.contains(qs, na=False)
-        ].copy()
-
-    filtered["LABEL"] = filtered.apply(
-        lambda r: f"{r['MODEL']} | {r['AÇIKLAMA']} | {eur_fmt_dec(r['LİSTE FİYATI'], 2)} EUR",
-        axis=1,
-    )
+        filtered = pl[pl["_SEARCH_U"].str.contains(qs, na=False, regex=False)]
+        if len(filtered) > 200:
+            st.caption(f"{len(filtered)} eşleşmeden ilk 200'ü gösteriliyor — aramayı daraltın.")
+            filtered = filtered.head(200)
+    elif len(pl) > 200:
+        # Boş aramada binlerce ürünü selectbox'a basma; kullanıcı zaten arayarak daraltıyor
+        filtered = pl.head(200)
+        st.caption("İlk 200 ürün gösteriliyor — arama ile daraltın.")
 
     if len(filtered) == 0:
         st.info("Arama kriterine uygun ürün yok.")
         selected = None
     else:
-        selected_label = st.selectbox("Ürün seç", filtered["LABEL"].tolist())
-        selected = filtered[filtered["LABEL"] == selected_label].iloc[0].to_dict()
+        # LABEL: pl'i mutasyona uğratmamak için ayrı bir Series (kopya yok);
+        # selectbox'a satır index'i verilir, seçim pl.loc ile O(1) çözülür
+        labels = filtered["MODEL"].str.cat([filtered["AÇIKLAMA"], filtered["_PRICE_FMT"]], sep=" | ") + " EUR"
+        selected_idx = st.selectbox("Ürün seç", filtered.index.tolist(), format_func=lambda i: labels.at[i])
+        selected = pl.loc[selected_idx].to_dict()
 
     qty = st.number_input("Adet", min_value=1, value=1, step=1)
 
@@ -492,110 +709,148 @@ with colA:
         st.write(f"**İskontolu birim fiyat:** {eur_fmt_dec(unit, 2)} EUR + KDV")
 
         if st.button("Sepete ekle", type="primary", use_container_width=True):
-            found = False
-            for r in st.session_state.cart:
-                if r["MODEL"] == selected["MODEL"]:
-                    r["ADET"] = int(r["ADET"]) + int(qty)
-                    found = True
-                    break
-            if not found:
-                st.session_state.cart.append(
+            model = str(selected["MODEL"])  # category değerini düz str'e normalize et
+            cart = st.session_state.cart
+            idx = st.session_state.cart_index.get(model)
+            if idx is not None:
+                adet_col = cart.columns.get_loc("ADET")
+                cart.iat[idx, adet_col] = int(cart.iat[idx, adet_col]) + int(qty)
+            else:
+                st.session_state.cart_index[model] = len(cart)
+                new_row = pd.DataFrame(
                     {
-                        "MODEL": selected["MODEL"],
-                        "AÇIKLAMA": selected["AÇIKLAMA"],
-                        "LİSTE FİYATI": list_price,
-                        "ADET": int(qty),
+                        "MODEL": [model],
+                        "AÇIKLAMA": [selected["AÇIKLAMA"]],
+                        "LİSTE FİYATI": [float(list_price)],
+                        "ADET": [int(qty)],
                     }
                 )
+                st.session_state.cart = pd.concat([cart, new_row], ignore_index=True)
             st.rerun()
 
-with colB:
+@st.fragment
+def cart_panel(iskonto: float, meta: dict):
+    """Sepet kolonu; sepet düzenlemeleri yalnızca bu fragment'ı rerun eder."""
     st.subheader("Sepet / Teklif Kalemleri")
 
     if len(st.session_state.cart) == 0:
         st.info("Sepet boş. Soldan ürün ekleyin.")
-    else:
-        cart_df = pd.DataFrame(st.session_state.cart)
-        cart_df["BİRİM (EUR)"] = cart_df["LİSTE FİYATI"].apply(lambda p: calc_discounted(float(p), float(iskonto)))
-        cart_df["TOPLAM (EUR)"] = cart_df["BİRİM (EUR)"] * cart_df["ADET"].astype(int)
-        total = float(cart_df["TOPLAM (EUR)"].sum())
+        return
+
+    cart_df = st.session_state.cart.copy()
+    factor = 1.0 - float(iskonto) / 100.0
+    prices = cart_df["LİSTE FİYATI"].to_numpy(dtype=np.float64)
+    qtys = cart_df["ADET"].to_numpy(dtype=np.int64)
+    unit = np.round(prices * factor, 2)
+    line_totals = np.round(unit * qtys, 2)
+    cart_df["BİRİM (EUR)"] = unit
+    cart_df["TOPLAM (EUR)"] = line_totals
+    total = float(line_totals.sum())
+
+    edit_df = cart_df[["MODEL", "AÇIKLAMA", "ADET", "BİRİM (EUR)", "TOPLAM (EUR)"]].copy()
+    edit_df["SİL"] = False
+
+    edited = st.data_editor(
+        edit_df,
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            "ADET": st.column_config.NumberColumn("ADET", min_value=1, step=1),
+            "BİRİM (EUR)": st.column_config.NumberColumn("BİRİM (EUR)", format="%.2f"),
+            "TOPLAM (EUR)": st.column_config.NumberColumn("TOPLAM (EUR)", format="%.2f"),
+            "SİL": st.column_config.CheckboxColumn("SİL"),
+        },
+        disabled=["MODEL", "AÇIKLAMA", "BİRİM (EUR)", "TOPLAM (EUR)"],
+        key="cart_editor",
+    )
 
-        edit_df = cart_df[["MODEL", "AÇIKLAMA", "ADET", "BİRİM (EUR)", "TOPLAM (EUR)"]].copy()
-        edit_df["SİL"] = False
+    c1, c2 = st.columns([1, 1])
+    with c1:
+        if st.button("Değişiklikleri uygula", use_container_width=True):
+            price_by_model = dict(zip(cart_df["MODEL"], cart_df["LİSTE FİYATI"]))
+            keep = [
+                {
+                    "MODEL": model,
+                    "AÇIKLAMA": aciklama,
+                    "LİSTE FİYATI": float(price_by_model[model]),
+                    "ADET": int(adet),
+                }
+                for model, aciklama, adet, sil in edited[
+                    ["MODEL", "AÇIKLAMA", "ADET", "SİL"]
+                ].itertuples(index=False, name=None)
+                if not bool(sil)
+            ]
+            st.session_state.cart = pd.DataFrame(keep).astype(_CART_COLUMNS) if keep else _empty_cart()
+            st.session_state.cart_index = {row["MODEL"]: i for i, row in enumerate(keep)}
 
-        edited = st.data_editor(
-            edit_df,
-            use_container_width=True,
-            hide_index=True,
-            column_config={
-                "ADET": st.column_config.NumberColumn("ADET", min_value=1, step=1),
-                "BİRİM (EUR)": st.column_config.NumberColumn("BİRİM (EUR)", format="%.2f"),
-                "TOPLAM (EUR)": st.column_config.NumberColumn("TOPLAM (EUR)", format="%.2f"),
-                "SİL": st.column_config.CheckboxColumn("SİL"),
-            },
-            disabled=["MODEL", "AÇIKLAMA", "BİRİM (EUR)", "TOPLAM (EUR)"],
-            key="cart_editor",
-        )
+            from streamlit.errors import StreamlitAPIException
 
-        c1, c2 = st.columns([1, 1])
-        with c1:
-            if st.button("Değişiklikleri uygula", use_container_width=True):
-                keep = []
-                for _, r in edited.iterrows():
-                    if bool(r.get("SİL", False)):
-                        continue
-                    keep.append(
-                        {
-                            "MODEL": r["MODEL"],
-                            "AÇIKLAMA": r["AÇIKLAMA"],
-                            "LİSTE FİYATI": float(cart_df[cart_df["MODEL"] == r["MODEL"]]["LİSTE FİYATI"].iloc[0]),
-                            "ADET": int(r["ADET"]),
-                        }
-                    )
-                st.session_state.cart = keep
+            try:
+                st.rerun(scope="fragment")
+            except StreamlitAPIException:
+                # fragment gövdesi tam script çalışması içinde koşuyorsa
+                # fragment scope'u geçersizdir; tam rerun'a düş
                 st.rerun()
 
-        with c2:
-            st.metric("Kümülatif Toplam", f"{eur_fmt_dec(total, 2)} EUR + KDV")
-
-        st.divider()
-
-        st.markdown("**Satır formatı (müşteriye kopyala-yapıştır)**")
-        lines = []
-        for _, r in cart_df.iterrows():
-            unit_txt = eur_fmt_dec(float(r["BİRİM (EUR)"]), 2)
-            lines.append(
-                f"{r['MODEL']} / {r['AÇIKLAMA']} / {int(r['ADET'])} ADET / {unit_txt} EUR + KDV"
-            )
-        st.code("\n".join(lines), language="text")
-
-        meta = {
-            "tarih": tarih.strftime("%d.%m.%Y"),
-            "gecerlilik": gecerlilik.strftime("%d.%m.%Y"),
-            "firma": firma.strip() or "-",
-            "yetkili": yetkili.strip() or "-",
-            "proje": proje.strip() or "-",
-            "hazirlayan": hazirlayan,
-            "email": email,
-            "telefon": telefon,
+    with c2:
+        st.metric("Kümülatif Toplam", f"{eur_fmt_dec(total, 2)} EUR + KDV")
+
+    st.divider()
+
+    rows_key = cart_rows_key(cart_df)
+
+    st.markdown("**Satır formatı (müşteriye kopyala-yapıştır)**")
+    st.code(format_cart_lines(rows_key), language="text")
+
+    meta_key = tuple(sorted(meta.items()))
+    state_key = hash((meta_key, rows_key, total))
+
+    # Çıktılar her rerun'da değil, kullanıcı istediğinde üretilir; girdiler
+    # değişmediği sürece aynı bytes session'dan servis edilir
+    render_cache = st.session_state.get("render_cache")
+    fresh = render_cache is not None and render_cache["key"] == state_key
+
+    if not fresh and st.button("Çıktıları hazırla (PDF + PNG)", type="primary", use_container_width=True):
+        render_cache = {
+            "key": state_key,
+            "pdf": build_pdf_cached(meta_key, rows_key, total),
+            "png": build_png_cached(meta_key, rows_key, total),
         }
+        st.session_state.render_cache = render_cache
+        fresh = True
 
-        pdf_bytes = build_pdf_bytes(meta, cart_df, total)
+    if fresh:
         st.download_button(
             label="PDF indir (KODSAN TEKLİF)",
-            data=pdf_bytes,
+            data=render_cache["pdf"],
             file_name=f"Kodsan_Teklif_{meta['firma'].replace(' ', '_')}_{meta['tarih'].replace('.', '-')}.pdf",
             mime="application/pdf",
             use_container_width=True,
         )
 
-        png_bytes = build_table_png_bytes(cart_df, meta, total)
         st.download_button(
             label="PNG indir (ekran görüntüsü gibi)",
-            data=png_bytes,
+            data=render_cache["png"],
             file_name=f"Teklif_{meta['firma'].replace(' ', '_')}_{meta['tarih'].replace('.', '-')}.png",
             mime="image/png",
             use_container_width=True,
         )
+    else:
+        st.caption("Teklif çıktıları için önce 'Çıktıları hazırla' butonuna basın.")
+
+
+meta = {
+    "tarih": tarih.strftime("%d.%m.%Y"),
+    "gecerlilik": gecerlilik.strftime("%d.%m.%Y"),
+    "firma": firma.strip() or "-",
+    "yetkili": yetkili.strip() or "-",
+    "proje": proje.strip() or "-",
+    "hazirlayan": hazirlayan,
+    "email": email,
+    "telefon": telefon,
+}
+
+with colB:
+    cart_panel(float(iskonto), meta)
 
 st.caption("Fiyatlar EUR bazında; KDV hariç gösterilir. İskonto, liste fiyatına yüzde olarak uygulanır.")